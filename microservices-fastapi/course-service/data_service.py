@@ -3,37 +3,36 @@ from models import Course
 
 class CourseMockDataService:
     def __init__(self):
-        self.courses = [
+        courses = [
             Course(id=1, name="Computer Science", code="CS101", description="Introduction to Computer Science", credits=3),
             Course(id=2, name="Information Technology", code="IT201", description="Fundamentals of Information Technology", credits=3),
             Course(id=3, name="Software Engineering", code="SE301", description="Principles of Software Engineering", credits=4),
         ]
+        # Courses keyed by id; dicts keep insertion order, so listing order is unchanged
+        self.courses = {c.id: c for c in courses}
         self.next_id = 4
 
     def get_all_courses(self):
-        return self.courses
+        return list(self.courses.values())
 
     def get_course_by_id(self, course_id: int):
-        return next((c for c in self.courses if c.id == course_id), None)
+        return self.courses.get(course_id)
 
     def add_course(self, course_data):
-        new_course = Course(id=self.next_id, **course_data.dict())
-        self.courses.append(new_course)
+        # course_data was already validated as a CourseCreate, so skip re-validating it
+        new_course = Course.model_construct(id=self.next_id, **course_data.model_dump(exclude_unset=True))
+        self.courses[new_course.id] = new_course
         self.next_id += 1
         return new_course
 
     def update_course(self, course_id: int, course_data):
         course = self.get_course_by_id(course_id)
         if course:
-            update_data = course_data.dict(exclude_unset=True)
+            update_data = course_data.model_dump(exclude_unset=True)
             for key, value in update_data.items():
                 setattr(course, key, value)
             return course
         return None
 
     def delete_course(self, course_id: int):
-        course = self.get_course_by_id(course_id)
-        if course:
-            self.courses.remove(course)
-            return True
-        return False
+        return self.courses.pop(course_id, None) is not None
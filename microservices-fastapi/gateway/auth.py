@@ -1,10 +1,13 @@
 # gateway/auth.py - Activity 2: JWT Authentication
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
+import jwt
+import anyio
 import bcrypt
+import hashlib
+import os
+import time
 from pydantic import BaseModel
-from datetime import datetime, timedelta
 from typing import Optional
 
 # JWT Configuration
@@ -12,9 +15,23 @@ SECRET_KEY = "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# bcrypt cost factor (work grows as 2^rounds)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+# Decoded token cache: sha256(token) -> (user, exp)
+_token_cache: dict[bytes, tuple[dict, float]] = {}
+TOKEN_CACHE_SWEEP_INTERVAL = 1000
+TOKEN_CACHE_MAX = 10_000
+_token_cache_inserts = 0
+
+
+# Hashes are kept as bytes, the form bcrypt.checkpw takes, so logins skip re-encoding them
+def _hash_password_sync(password: str) -> bytes:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+
+async def hash_password(password: str) -> bytes:
+    # Same as verify_password: keep bcrypt off the event loop
+    return await anyio.to_thread.run_sync(_hash_password_sync, password)
 
 
 # OAuth2 scheme
@@ -24,7 +41,7 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 fake_users_db = {
     "admin": {
         "username": "admin",
-        "hashed_password": hash_password("admin123"),
+        "hashed_password": _hash_password_sync("admin123"),
         "role": "admin"
     }
 }
@@ -46,40 +63,73 @@ class UserResponse(BaseModel):
     role: str
 
 # Helper functions
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
+async def verify_password(plain_password: str, hashed_password: bytes) -> bool:
+    # bcrypt is CPU-bound; run it in a worker thread to keep the event loop free
+    return await anyio.to_thread.run_sync(bcrypt.checkpw, plain_password.encode("utf-8"), hashed_password)
 
 def get_user(username: str) -> Optional[dict]:
     return fake_users_db.get(username)
 
-def authenticate_user(username: str, password: str) -> Optional[dict]:
+async def authenticate_user(username: str, password: str) -> Optional[dict]:
     user = get_user(username)
-    if not user or not verify_password(password, user["hashed_password"]):
+    if not user or not await verify_password(password, user["hashed_password"]):
         return None
     return user
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+def create_access_token(data: dict, expires_seconds: Optional[int] = None) -> str:
     to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
-    to_encode.update({"exp": expire})
+    to_encode["exp"] = int(time.time()) + (expires_seconds or 900)
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
-    """Dependency to validate JWT token and return current user"""
+def _cache_token(key: bytes, user: dict, exp: float) -> None:
+    global _token_cache_inserts
+    _token_cache[key] = (user, exp)
+    if len(_token_cache) > TOKEN_CACHE_MAX:
+        # Dicts keep insertion order, so the first key is the oldest entry
+        del _token_cache[next(iter(_token_cache))]
+    _token_cache_inserts += 1
+    if _token_cache_inserts % TOKEN_CACHE_SWEEP_INTERVAL == 0:
+        now = time.time()
+        for k in [k for k, (_, e) in _token_cache.items() if e <= now]:
+            del _token_cache[k]
+
+def invalidate_user_tokens(username: str) -> None:
+    """Drop cached tokens for a user; call when a user is removed or their password changes"""
+    for k in [k for k, (u, _) in _token_cache.items() if u["username"] == username]:
+        del _token_cache[k]
+
+def _user_from_token(token: str) -> dict:
+    key = hashlib.sha256(token.encode("utf-8")).digest()
+    cached = _token_cache.get(key)
+    if cached is not None and cached[1] > time.time():
+        return cached[0]
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(
+            token, SECRET_KEY, algorithms=[ALGORITHM], options={"require": ["exp", "sub"]}
+        )
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-    except JWTError:
+    except jwt.PyJWTError:
         raise credentials_exception
 
     user = get_user(username)
     if user is None:
         raise credentials_exception
+    _cache_token(key, user, payload["exp"])
+    return user
+
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme)) -> dict:
+    """Dependency to validate JWT token and return current user"""
+    # Resolve the token at most once per request, however many dependents ask for it
+    user = getattr(request.state, "user", None)
+    if user is None:
+        user = _user_from_token(token)
+        request.state.user = user
     return user
@@ -1,12 +1,14 @@
 # gateway/main.py
-from fastapi import FastAPI, HTTPException, Request, Depends
+from fastapi import FastAPI, HTTPException, Request, Response, Depends
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.responses import JSONResponse
+import asyncio
+from contextlib import asynccontextmanager
+import inspect
 import httpx
 import logging
-import time
+import orjson
+import re
 from typing import Any
-from datetime import timedelta
 from auth import (
     authenticate_user, create_access_token, get_current_user,
     fake_users_db, hash_password,
@@ -18,81 +20,117 @@ from auth import (
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("api_gateway")
 
-app = FastAPI(title="API Gateway", version="1.0.0")
-
 # Service URLs
 SERVICES = {
     "student": "http://localhost:8001",
     "course": "http://localhost:8002"
 }
+SERVICE_NAMES = tuple(SERVICES)
+
+ALLOWED_METHODS = {"GET", "POST", "PUT", "DELETE", "PATCH", "HEAD"}
+
+# Pre-encoded fallback body for upstream errors that come back empty
+UNKNOWN_ERROR_BODY = orjson.dumps({"detail": "Unknown error from service"})
+
+# Maximum number of downstream calls a single fan_out runs at once
+FAN_OUT_CONCURRENCY = 20
+
+# One shared HTTP client per service, created with the service's base_url so
+# forwarded calls only pass a path; keep-alive connections are reused.
+# HTTP/2 is negotiated via ALPN, so it only takes effect when the services are
+# reached over TLS through an HTTP/2-capable server (e.g. Hypercorn).
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=100)
+HTTP_TIMEOUT = httpx.Timeout(10.0, connect=2.0)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.clients = {
+        name: httpx.AsyncClient(base_url=url, http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+        for name, url in SERVICES.items()
+    }
+    yield
+    for client in app.state.clients.values():
+        await client.aclose()
+
+app = FastAPI(title="API Gateway", version="1.0.0", lifespan=lifespan)
 
 # Activity 3: Request Logging Middleware
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    start_time = time.time()
-    logger.info(f"Incoming request: {request.method} {request.url}")
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    logger.info("Incoming request: %s %s", request.method, request.url)
     response = await call_next(request)
-    process_time = time.time() - start_time
-    logger.info(f"Response: {request.method} {request.url} - Status: {response.status_code} - Time: {process_time:.4f}s")
+    process_time = loop.time() - start_time
+    logger.info("Response: %s %s - Status: %s - Time: %.4fs", request.method, request.url, response.status_code, process_time)
     return response
 
+def content_type_header(request: Request) -> dict:
+    """Content-type to send along with a raw forwarded body"""
+    return {"content-type": request.headers.get("content-type", "application/json")}
+
 async def forward_request(service: str, path: str, method: str, **kwargs) -> Any:
     """Forward request to the appropriate microservice"""
-    if service not in SERVICES:
-        raise HTTPException(status_code=404, detail=f"Service '{service}' not found. Available services: {list(SERVICES.keys())}")
-
-    url = f"{SERVICES[service]}{path}"
-
-    async with httpx.AsyncClient() as client:
-        try:
-            if method == "GET":
-                response = await client.get(url, **kwargs)
-            elif method == "POST":
-                response = await client.post(url, **kwargs)
-            elif method == "PUT":
-                response = await client.put(url, **kwargs)
-            elif method == "DELETE":
-                response = await client.delete(url, **kwargs)
-            else:
-                raise HTTPException(status_code=405, detail=f"Method '{method}' not allowed")
-
-            # Activity 4: Enhanced error handling
-            if response.status_code >= 400:
-                error_detail = response.json() if response.text else {"detail": "Unknown error from service"}
-                return JSONResponse(
-                    content=error_detail,
-                    status_code=response.status_code
-                )
-
-            return JSONResponse(
-                content=response.json() if response.text else None,
-                status_code=response.status_code
-            )
-        except httpx.ConnectError:
-            raise HTTPException(
-                status_code=503,
-                detail=f"Service '{service}' is unavailable. Please ensure the service is running on {SERVICES[service]}"
-            )
-        except httpx.TimeoutException:
-            raise HTTPException(
-                status_code=504,
-                detail=f"Request to service '{service}' timed out"
-            )
-        except httpx.RequestError as e:
-            raise HTTPException(
-                status_code=503,
-                detail=f"Service unavailable: {str(e)}"
+    client = app.state.clients.get(service)
+    if client is None:
+        raise HTTPException(status_code=404, detail=f"Service '{service}' not found. Available services: {SERVICE_NAMES}")
+
+    method = method.upper()
+    if method not in ALLOWED_METHODS:
+        raise HTTPException(status_code=405, detail=f"Method '{method}' not allowed")
+
+    try:
+        response = await client.request(method, path, **kwargs)
+
+        # Activity 4: Enhanced error handling
+        if response.status_code >= 400 and not response.content:
+            return Response(
+                content=UNKNOWN_ERROR_BODY,
+                status_code=response.status_code,
+                media_type="application/json"
             )
 
+        # Pass the upstream body through as-is instead of decoding and re-encoding it
+        return Response(
+            content=response.content,
+            status_code=response.status_code,
+            media_type=response.headers.get("content-type")
+        )
+    except httpx.ConnectError:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service '{service}' is unavailable. Please ensure the service is running on {client.base_url}"
+        )
+    except httpx.TimeoutException:
+        raise HTTPException(
+            status_code=504,
+            detail=f"Request to service '{service}' timed out"
+        )
+    except httpx.RequestError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service unavailable: {str(e)}"
+        )
+
+async def fan_out(calls: list) -> list:
+    """Run several forward_request calls concurrently and return their responses in order"""
+    sem = asyncio.Semaphore(FAN_OUT_CONCURRENCY)
+
+    async def run(call):
+        async with sem:
+            return await forward_request(*call)
+
+    return await asyncio.gather(*(run(call) for call in calls))
+
 @app.get("/")
 def read_root():
-    return {"message": "API Gateway is running", "available_services": list(SERVICES.keys())}
+    return {"message": "API Gateway is running", "available_services": list(SERVICE_NAMES)}
 
 
 @app.post("/auth/login", response_model=Token)
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     """Authenticate user and return JWT token"""
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=401,
@@ -101,74 +139,88 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         )
     access_token = create_access_token(
         data={"sub": user["username"]},
-        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        expires_seconds=ACCESS_TOKEN_EXPIRE_MINUTES * 60
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/auth/register", response_model=UserResponse)
 async def register(user: UserCreate):
     """Register a new user"""
+    if user.username in fake_users_db:
+        raise HTTPException(status_code=400, detail="Username already exists")
+    hashed_password = await hash_password(user.password)
+    # Another registration may have claimed the name while we were hashing
     if user.username in fake_users_db:
         raise HTTPException(status_code=400, detail="Username already exists")
     fake_users_db[user.username] = {
         "username": user.username,
-        "hashed_password": hash_password(user.password),
+        "hashed_password": hashed_password,
         "role": "user"
     }
     return {"username": user.username, "role": "user"}
 
 
-@app.get("/gateway/students")
-async def get_all_students(current_user: dict = Depends(get_current_user)):
-    """Get all students through gateway"""
-    return await forward_request("student", "/api/students", "GET")
-
-@app.get("/gateway/students/{student_id}")
-async def get_student(student_id: int, current_user: dict = Depends(get_current_user)):
-    """Get a student by ID through gateway"""
-    return await forward_request("student", f"/api/students/{student_id}", "GET")
-
-@app.post("/gateway/students")
-async def create_student(request: Request, current_user: dict = Depends(get_current_user)):
-    """Create a new student through gateway"""
-    body = await request.json()
-    return await forward_request("student", "/api/students", "POST", json=body)
-
-@app.put("/gateway/students/{student_id}")
-async def update_student(student_id: int, request: Request, current_user: dict = Depends(get_current_user)):
-    """Update a student through gateway"""
-    body = await request.json()
-    return await forward_request("student", f"/api/students/{student_id}", "PUT", json=body)
-
-@app.delete("/gateway/students/{student_id}")
-async def delete_student(student_id: int, current_user: dict = Depends(get_current_user)):
-    """Delete a student through gateway"""
-    return await forward_request("student", f"/api/students/{student_id}", "DELETE")
-
-
-@app.get("/gateway/courses")
-async def get_all_courses(current_user: dict = Depends(get_current_user)):
-    """Get all courses through gateway"""
-    return await forward_request("course", "/api/courses", "GET")
-
-@app.get("/gateway/courses/{course_id}")
-async def get_course(course_id: int, current_user: dict = Depends(get_current_user)):
-    """Get a course by ID through gateway"""
-    return await forward_request("course", f"/api/courses/{course_id}", "GET")
-
-@app.post("/gateway/courses")
-async def create_course(request: Request, current_user: dict = Depends(get_current_user)):
-    """Create a new course through gateway"""
-    body = await request.json()
-    return await forward_request("course", "/api/courses", "POST", json=body)
-
-@app.put("/gateway/courses/{course_id}")
-async def update_course(course_id: int, request: Request, current_user: dict = Depends(get_current_user)):
-    """Update a course through gateway"""
-    body = await request.json()
-    return await forward_request("course", f"/api/courses/{course_id}", "PUT", json=body)
-
-@app.delete("/gateway/courses/{course_id}")
-async def delete_course(course_id: int, current_user: dict = Depends(get_current_user)):
-    """Delete a course through gateway"""
-    return await forward_request("course", f"/api/courses/{course_id}", "DELETE")
+# Plain 1:1 proxy routes: (method, gateway path, service, upstream path, name, description)
+ROUTES = [
+    ("GET", "/gateway/students", "student", "/api/students", "get_all_students", "Get all students through gateway"),
+    ("GET", "/gateway/students/{student_id}", "student", "/api/students/{student_id}", "get_student", "Get a student by ID through gateway"),
+    ("POST", "/gateway/students", "student", "/api/students", "create_student", "Create a new student through gateway"),
+    ("PUT", "/gateway/students/{student_id}", "student", "/api/students/{student_id}", "update_student", "Update a student through gateway"),
+    ("DELETE", "/gateway/students/{student_id}", "student", "/api/students/{student_id}", "delete_student", "Delete a student through gateway"),
+    ("GET", "/gateway/courses", "course", "/api/courses", "get_all_courses", "Get all courses through gateway"),
+    ("GET", "/gateway/courses/{course_id}", "course", "/api/courses/{course_id}", "get_course", "Get a course by ID through gateway"),
+    ("POST", "/gateway/courses", "course", "/api/courses", "create_course", "Create a new course through gateway"),
+    ("PUT", "/gateway/courses/{course_id}", "course", "/api/courses/{course_id}", "update_course", "Update a course through gateway"),
+    ("DELETE", "/gateway/courses/{course_id}", "course", "/api/courses/{course_id}", "delete_course", "Delete a course through gateway"),
+]
+BODY_METHODS = {"POST", "PUT", "PATCH"}
+
+def make_handler(service: str, gateway_path: str, upstream_path: str, method: str, description: str):
+    """Build a proxy endpoint that forwards to upstream_path, filled in from the request's path params"""
+    has_body = method in BODY_METHODS
+
+    async def handler(request: Request, **path_params):
+        path = upstream_path.format(**path_params)
+        if has_body:
+            raw = await request.body()
+            return await forward_request(service, path, method, content=raw, headers=content_type_header(request))
+        return await forward_request(service, path, method)
+
+    # Expose the path params to FastAPI as ints so they are validated and documented
+    handler.__signature__ = inspect.Signature(
+        [inspect.Parameter("request", inspect.Parameter.POSITIONAL_OR_KEYWORD, annotation=Request)]
+        + [
+            inspect.Parameter(name, inspect.Parameter.KEYWORD_ONLY, annotation=int)
+            for name in re.findall(r"{(\w+)}", gateway_path)
+        ]
+    )
+    handler.__doc__ = description
+    return handler
+
+for method, gateway_path, service, upstream_path, name, description in ROUTES:
+    app.add_api_route(
+        gateway_path,
+        make_handler(service, gateway_path, upstream_path, method, description),
+        methods=[method],
+        name=name,
+        dependencies=[Depends(get_current_user)],
+    )
+
+@app.get("/gateway/students/{student_id}/with-courses")
+async def get_student_with_courses(student_id: int, current_user: dict = Depends(get_current_user)):
+    """Get a student and their course details through gateway"""
+    student_response, courses_response = await fan_out([
+        ("student", f"/api/students/{student_id}", "GET"),
+        ("course", "/api/courses", "GET"),
+    ])
+    for response in (student_response, courses_response):
+        if response.status_code >= 400:
+            return response
+
+    student = orjson.loads(student_response.body)
+    courses = orjson.loads(courses_response.body)
+    # No response model here, so encode with orjson directly
+    return Response(
+        content=orjson.dumps({**student, "courses": [c for c in courses if c["name"] == student["course"]]}),
+        media_type="application/json"
+    )